@@ -1,11 +1,42 @@
-import array, random, rp2
+import array, micropython, random, rp2, time
 from machine import Pin
+from micropython import const
+
+_PIO0_TXF0 = const(0x50200010)
+_PIO_STRIDE = const(0x100000)
+_DREQ_PIO0_TX0 = const(0)
+_DREQ_PIO_STRIDE = const(8)
+_NUM_SMS = const(8)
+# Time for the last 24 bits to leave the OSR once the TX FIFO is empty.
+_OSR_US = const(30)
+# Low time the strip needs to latch a frame. WS2812B-V5 and many clones need 280us rather than the original 50us.
+_RESET_US = const(300)
+
+@rp2.asm_pio(sideset_init=rp2.PIO.OUT_LOW, out_shiftdir=rp2.PIO.SHIFT_LEFT, autopull=True, pull_thresh=24)
+def _WS2812_PIO():
+    T1 = 2
+    T2 = 5
+    T3 = 3
+    wrap_target()
+    label("bitloop")
+    out(x, 1)               .side(0) [T3 - 1]
+    jmp(not_x, "do_zero")   .side(1) [T1 - 1]
+    jmp("bitloop")          .side(1) [T2 - 1]
+    label("do_zero")
+    nop()                   .side(0) [T2 - 1]
+    wrap()
+
+def _fixed_brightness(brightness: float) -> int:
+    """Converts a brightness to 8 bit fixed point, clamped to 0-256 so scaled channels never exceed 255."""
+    return max(0, min(int(brightness * 256), 256))
 
 class WS2812:
     
     """MicroPython Controller for talking with the WS2812 RGB Light Strip."""
     
-    def __init__(self, num_leds: int, pin_num: int, brightness: float = 0.1, random_generator: Callable(int, int) = random.randint):
+    _sm_ids_in_use = set()
+    
+    def __init__(self, num_leds: int, pin_num: int, brightness: float = 0.1, random_generator: Callable(int, int) = random.randint, reset_us: int = _RESET_US, sm_id: int = None):
         """
         Initialize the light strip.
 
@@ -14,44 +45,171 @@ class WS2812:
         pin_num (int): The pin number that the strip is connected to.
         brightness (float) (optional): Sets the initial brightness of the light strip for a value between 0 and 1 (Defaults to 0.1).
         random_generator (Callable(int, int)) (optional): The random number generator to use. Defaults to random.randint.
+        reset_us (int) (optional): How long in microseconds the line is held low between frames so the strip latches them. Defaults to 300.
+        sm_id (int) (optional): The PIO state machine (0-7) to drive the strip with. Defaults to the first one not used by another strip.
+        
+        Brightness is stored per pixel in 8 bit fixed point, where 256 is full brightness.
         
         """
         self.NUM_LEDS = num_leds
         self.PIN_NUM = pin_num
         self.RANDOM = random_generator
-        self.BRIGHTNESS = array.array("d", [brightness for _ in range(self.NUM_LEDS)])
-        self.AR = array.array("I", [0 for _ in range(self.NUM_LEDS)])
+        self.RESET_US = reset_us
+        self.BRIGHTNESS = array.array("H", [_fixed_brightness(brightness)] * self.NUM_LEDS)
+        self.RED = bytearray(self.NUM_LEDS)
+        self.GREEN = bytearray(self.NUM_LEDS)
+        self.BLUE = bytearray(self.NUM_LEDS)
+        self.DIMMER_AR = array.array("I", bytearray(4 * self.NUM_LEDS))
+        self.FRONT_AR = array.array("I", bytearray(4 * self.NUM_LEDS))
+        self.GAMMA = bytearray(range(256))
+        self.DIRTY = False
+        self.SM_ID = self._free_sm_id() if sm_id is None else sm_id
         self.SM = self._init_state_machine()
+        self.SM_PUT = self.SM.put
+        self.DMA = self._init_dma()
+        self.SENDING = False
+        WS2812._sm_ids_in_use.add(self.SM_ID)
+
+    def _free_sm_id(self) -> int:
+        """
+        Finds a state machine that no other strip is using.
+        
+        Returns:
+        int: The lowest free state machine number.
+        
+        Raises:
+        ValueError: If every state machine is already in use.
+        
+        """
+        for sm_id in range(_NUM_SMS):
+            if sm_id not in WS2812._sm_ids_in_use:
+                return sm_id
+        raise ValueError("no free state machine, deinit() a strip first")
 
     def _init_state_machine(self):
         """Initialize the state of the light strip."""
-        @rp2.asm_pio(sideset_init=rp2.PIO.OUT_LOW, out_shiftdir=rp2.PIO.SHIFT_LEFT, autopull=True, pull_thresh=24)
-        def ws2812():
-            T1 = 2
-            T2 = 5
-            T3 = 3
-            wrap_target()
-            label("bitloop")
-            out(x, 1)               .side(0) [T3 - 1]
-            jmp(not_x, "do_zero")   .side(1) [T1 - 1]
-            jmp("bitloop")          .side(1) [T2 - 1]
-            label("do_zero")
-            nop()                   .side(0) [T2 - 1]
-            wrap()
-        
-        SM = rp2.StateMachine(0, ws2812, freq=8_000_000, sideset_base=Pin(self.PIN_NUM))
+        SM = rp2.StateMachine(self.SM_ID, _WS2812_PIO, freq=8_000_000, sideset_base=Pin(self.PIN_NUM))
         SM.active(1)
         return SM
 
+    def _init_dma(self):
+        """Initialize the DMA channel feeding the state machine, or None if the firmware has no rp2.DMA."""
+        if not hasattr(rp2, "DMA"):
+            return None
+        pio, sm = self.SM_ID >> 2, self.SM_ID & 3
+        self.TXF = _PIO0_TXF0 + pio * _PIO_STRIDE + 4 * sm
+        DMA = rp2.DMA()
+        self.DMA_CTRL = DMA.pack_ctrl(size=2, inc_write=False, treq_sel=_DREQ_PIO0_TX0 + pio * _DREQ_PIO_STRIDE + sm)
+        return DMA
+
+    def _dim_pixel(self, i: int):
+        """
+        Stores the brightness scaled output word of a pixel.
+        
+        Args:
+        i (int): The pixel to scale.
+        
+        """
+        i = self._section_index(1, i)
+        self._dim_range(i, i + 1)
+
+    def _section_index(self, length: int, index: int) -> int:
+        """
+        Checks that a section lies within the strip.
+        
+        Args:
+        length (int): The length of the section.
+        index (int): Starting index of the section, zero-indexed. Negative values count back from the end of the strip.
+        
+        Returns:
+        int: The non-negative starting index of the section.
+        
+        Raises:
+        IndexError: If the section doesn't fit within the strip.
+        
+        """
+        if index < 0:
+            index += self.NUM_LEDS
+        if index < 0 or length < 0 or index + length > self.NUM_LEDS:
+            raise IndexError("section out of range")
+        return index
+
+    def _dim_section(self, length: int, index: int = 0):
+        """
+        Stores the brightness scaled output words of a section.
+        
+        Args:
+        length (int): The length of the section.
+        index (int) (optional): Starting index of the section, zero-indexed. Defaults to 0.
+        
+        """
+        index = self._section_index(length, index)
+        self._dim_range(index, index + length)
+
+    @micropython.viper
+    def _dim_range(self, start: int, end: int):
+        """
+        Stores the brightness scaled output words of pixels start to end. The range isn't checked, use _dim_section.
+        
+        Args:
+        start (int): The first pixel to scale.
+        end (int): The pixel after the last one to scale.
+        
+        """
+        red = ptr8(self.RED)
+        green = ptr8(self.GREEN)
+        blue = ptr8(self.BLUE)
+        bright = ptr16(self.BRIGHTNESS)
+        gamma = ptr8(self.GAMMA)
+        dimmer_ar = ptr32(self.DIMMER_AR)
+        i = start
+        while i < end:
+            bi = bright[i]
+            dimmer_ar[i] = (((gamma[green[i]] * bi)>>8)<<24) + (((gamma[red[i]] * bi)>>8)<<16) + (((gamma[blue[i]] * bi)>>8)<<8)
+            i += 1
+
     def update(self):
-        """Updates the current state of the light strip."""
-        dimmer_ar = array.array("I", [0 for _ in range(self.NUM_LEDS)])
-        for i, c in enumerate(self.AR):
-            r = int(((c >> 8) & 0xFF) * self.BRIGHTNESS[i])
-            g = int(((c >> 16) & 0xFF) * self.BRIGHTNESS[i])
-            b = int((c & 0xFF) * self.BRIGHTNESS[i])
-            dimmer_ar[i] = (g<<16) + (r<<8) + b
-        self.SM.put(dimmer_ar, 8)
+        """
+        Updates the current state of the light strip.
+        
+        Setters write DIMMER_AR, while the frame being sent is read from FRONT_AR, so the next frame can be set up while this one goes out.
+        
+        """
+        if self.DIRTY:
+            self._dim_section(self.NUM_LEDS, 0)
+            self.DIRTY = False
+        self.wait_update()
+        front_ar = self.FRONT_AR
+        front_ar[:] = self.DIMMER_AR
+        dma = self.DMA
+        if dma is None:
+            self.SM_PUT(front_ar)
+        else:
+            dma.config(read=front_ar, write=self.TXF, count=self.NUM_LEDS, ctrl=self.DMA_CTRL, trigger=True)
+        self.SENDING = True
+
+    def wait_update(self):
+        """Waits until the previous update has been sent and latched by the light strip."""
+        if not self.SENDING:
+            return
+        dma = self.DMA
+        if dma is not None:
+            while dma.active():
+                pass
+        sm = self.SM
+        while sm.tx_fifo():
+            pass
+        time.sleep_us(_OSR_US + self.RESET_US)
+        self.SENDING = False
+
+    def deinit(self):
+        """Stops the light strip's state machine and releases its DMA channel so they can be reused."""
+        self.wait_update()
+        self.SM.active(0)
+        if self.DMA is not None:
+            self.DMA.close()
+            self.DMA = None
+        WS2812._sm_ids_in_use.discard(self.SM_ID)
 
     def set_pixel_color(self, i: int, color: (int, int, int)):
         """
@@ -62,7 +220,10 @@ class WS2812:
         color ((int, int, int)): RGB value tuple to set the strip to.
         
         """
-        self.AR[i] = (color[1]<<16) + (color[0]<<8) + color[2]
+        self.RED[i] = color[0]
+        self.GREEN[i] = color[1]
+        self.BLUE[i] = color[2]
+        self._dim_pixel(i)
         
     def set_pixel_off(self, i: int):
         """
@@ -83,7 +244,8 @@ class WS2812:
         brightness (float): A value between 0 and 1 representing the new bightness for the pixel.
         
         """
-        self.BRIGHTNESS[i] = brightness
+        self.BRIGHTNESS[i] = _fixed_brightness(brightness)
+        self._dim_pixel(i)
         
     def set_pixel_brightness_random(self, i: int, minB: float = 0, maxB: float = 1):
         """
@@ -95,7 +257,8 @@ class WS2812:
         maxB (float) (optional): The maximum brightness to set the light to. Defaults to 1.
         
         """
-        self.BRIGHTNESS[i] = self.RANDOM(minB * 100, MaxB * 100) * 0.1
+        self.BRIGHTNESS[i] = self.RANDOM(_fixed_brightness(minB), _fixed_brightness(maxB))
+        self._dim_pixel(i)
         
     def set_pixel_random(self, i: int):
         """
@@ -105,10 +268,11 @@ class WS2812:
         i (int): The pixel to set randomly.
         
         """
-        r = self.RANDOM(0, 255)
-        g = self.RANDOM(0, 255)
-        b = self.RANDOM(0, 255)
-        self.set_pixel_color(i,(r, g, b))
+        v = self.RANDOM(0, 0xFFFFFF)
+        self.RED[i] = v>>16
+        self.GREEN[i] = (v>>8) & 0xFF
+        self.BLUE[i] = v & 0xFF
+        self._dim_pixel(i)
         
     def set_all(self, color: (int, int, int)):
         """
@@ -118,13 +282,19 @@ class WS2812:
         color ((int, int, int)): RGB value tuple to set the strip to.
         
         """
-        for i in range(len(self.AR)):
-            self.set_pixel_color(i, color)
+        self.set_section_solid(color, self.NUM_LEDS)
         
+    @micropython.native
     def set_all_off(self):
         """Sets all lights in the strip to off."""
-        self.set_all((0, 0, 0))
-        
+        red, green, blue, dimmer_ar = self.RED, self.GREEN, self.BLUE, self.DIMMER_AR
+        for i in range(self.NUM_LEDS):
+            red[i] = 0
+            green[i] = 0
+            blue[i] = 0
+            dimmer_ar[i] = 0
+        
+    @micropython.native
     def set_all_brightness(self, brightness: float):
         """
         Changes the brightness of the light strip.
@@ -133,8 +303,11 @@ class WS2812:
         brightness (float): A value between 0 and 1 representing the new bightness for the lightstrip.
         
         """
-        for i in range(len(self.BRIGHTNESS)):
-            self.BRIGHTNESS[i] = brightness
+        brightness = _fixed_brightness(brightness)
+        bright = self.BRIGHTNESS
+        for i in range(self.NUM_LEDS):
+            bright[i] = brightness
+        self.DIRTY = True
             
     def set_all_brightness_random(self, minB: float = 0, maxB: float = 1):
         """
@@ -145,9 +318,13 @@ class WS2812:
         maxB (float) (optional): The maximum brightness to set the light to. Defaults to 1.
         
         """
-        for i in range(len(self.BRIGHTNESS)):
-            self.set_pixel_brightness_random(i, minB, maxB)
+        minB, maxB = _fixed_brightness(minB), _fixed_brightness(maxB)
+        bright, random_generator = self.BRIGHTNESS, self.RANDOM
+        for i in range(self.NUM_LEDS):
+            bright[i] = random_generator(minB, maxB)
+        self.DIRTY = True
             
+    @micropython.native
     def set_all_brightness_random_solid(self, minB: float = 0, maxB: float = 1):
         """Sets the light strip to a uniform random brightness.
         
@@ -156,24 +333,23 @@ class WS2812:
         maxB (float) (optional): The maximum brightness to set the light to. Defaults to 1.
         
         """
-        rand_bright = self.RANDOM(minB, Maxb) * 0.1
-        for i in range(len(self.BRIGHTNESS)):
-            self.BRIGHTNESS[i] = rand_bright
+        rand_bright = self.RANDOM(_fixed_brightness(minB), _fixed_brightness(maxB))
+        bright = self.BRIGHTNESS
+        for i in range(self.NUM_LEDS):
+            bright[i] = rand_bright
+        self.DIRTY = True
         
     def set_all_random(self):
         """
         Fills the strip with random colors.
 
         """
-        for i in range(len(self.AR)):
-            self.set_pixel_random(i)
+        self.set_section_random(self.NUM_LEDS)
             
     def set_all_random_solid(self):
         """Sets all pixels to the same random color."""
-        r = self.RANDOM(0, 255)
-        g = self.RANDOM(0, 255)
-        b = self.RANDOM(0, 255)
-        self.set_all((r,g,b))
+        v = self.RANDOM(0, 0xFFFFFF)
+        self.set_all((v>>16, (v>>8) & 0xFF, v & 0xFF))
             
     def set_section(self, colors: List[[(int, int, int), None]], index: int = 0):
         """
@@ -183,11 +359,23 @@ class WS2812:
         colors (List[(int, int, int)], None]]): Array of colors to set the section to, with None values indicating random colors.
         index (int) (optional): Starting index of the section, zero-indexed. Defaults to 0.
         """
-        for i, color in enumerate(colors):
+        length = len(colors)
+        index = self._section_index(length, index)
+        red, green, blue = self.RED, self.GREEN, self.BLUE
+        random_generator = self.RANDOM
+        for i in range(length):
+            color = colors[i]
+            j = index + i
             if color is None:
-                self.set_pixel_random(index + i)
+                v = random_generator(0, 0xFFFFFF)
+                red[j] = v>>16
+                green[j] = (v>>8) & 0xFF
+                blue[j] = v & 0xFF
             else:
-                self.set_pixel_color(index + i, color)
+                red[j] = color[0]
+                green[j] = color[1]
+                blue[j] = color[2]
+        self._dim_section(length, index)
                 
     def set_section_off(self, length: int, index: int = 0):
         """
@@ -198,8 +386,12 @@ class WS2812:
         index (int) (optional): Starting index of the section, zero-indexed. Defaults to 0.
         
         """
-        for i in range(length):
-            self.set_pixel_off(index + i)
+        index = self._section_index(length, index)
+        off = bytearray(length)
+        self.RED[index:index + length] = off
+        self.GREEN[index:index + length] = off
+        self.BLUE[index:index + length] = off
+        self.DIMMER_AR[index:index + length] = array.array("I", bytearray(4 * length))
                 
     def set_section_solid(self, color: (int, int, int), length: int, index: int = 0):
         """
@@ -211,8 +403,11 @@ class WS2812:
         index (int) (optional): Starting index of the section, zero-indexed. Defaults to 0.
         
         """
-        for i in range(length):
-            self.set_pixel_color(index + i, color)
+        index = self._section_index(length, index)
+        self.RED[index:index + length] = bytes((color[0],)) * length
+        self.GREEN[index:index + length] = bytes((color[1],)) * length
+        self.BLUE[index:index + length] = bytes((color[2],)) * length
+        self._dim_section(length, index)
             
     def set_section_brightness(self, brightness: float, length: int, index: int = 0):
         """
@@ -224,8 +419,12 @@ class WS2812:
         index (int) (optional): Starting index of the section, zero-indexed. Defaults to 0.
         
         """
-        for i in range(length):
-            self.set_pixel_brightness(index + i, brightness)
+        index = self._section_index(length, index)
+        brightness = _fixed_brightness(brightness)
+        bright = self.BRIGHTNESS
+        for i in range(index, index + length):
+            bright[i] = brightness
+        self._dim_section(length, index)
             
     def set_section_brightness_random(self, length: int, index: int = 0, minB: float = 0, maxB: float = 1):
         """
@@ -238,8 +437,12 @@ class WS2812:
         maxB (float) (optional): The maximum brightness to set the light to. Defaults to 1.
         
         """
-        for i in range(length):
-            self.set_pixel_brightness_random(i, minB, maxB)
+        index = self._section_index(length, index)
+        minB, maxB = _fixed_brightness(minB), _fixed_brightness(maxB)
+        bright, random_generator = self.BRIGHTNESS, self.RANDOM
+        for i in range(index, index + length):
+            bright[i] = random_generator(minB, maxB)
+        self._dim_section(length, index)
             
     def set_section_brightness_random_solid(self, length: int, index: int = 0, minB: float = 0, maxB: float = 1):
         """
@@ -252,9 +455,12 @@ class WS2812:
         maxB (float) (optional): The maximum brightness to set the light to. Defaults to 1.
         
         """
-        rand_bright = self.RANDOM(minB * 100, maxB * 100) * 0.1
-        for i in range(length):
-            self.set_pixel_brightness(i, rand_bright)
+        index = self._section_index(length, index)
+        rand_bright = self.RANDOM(_fixed_brightness(minB), _fixed_brightness(maxB))
+        bright = self.BRIGHTNESS
+        for i in range(index, index + length):
+            bright[i] = rand_bright
+        self._dim_section(length, index)
                 
     def set_section_random(self, length: int, index: int = 0):
         """
@@ -265,8 +471,15 @@ class WS2812:
         index (int) (optional): Starting index of the section, zero-indexed. Defaults to 0.
         
         """
-        for i in range(length):
-            self.set_pixel_random(index + i)
+        index = self._section_index(length, index)
+        red, green, blue = self.RED, self.GREEN, self.BLUE
+        random_generator = self.RANDOM
+        for i in range(index, index + length):
+            v = random_generator(0, 0xFFFFFF)
+            red[i] = v>>16
+            green[i] = (v>>8) & 0xFF
+            blue[i] = v & 0xFF
+        self._dim_section(length, index)
             
     def set_section_random_solid(self, length: int, index: int = 0):
         """
@@ -277,10 +490,8 @@ class WS2812:
         index (int) (optional): Starting index of the section, zero-indexed. Defaults to 0.
         
         """
-        r = self.RANDOM(0, 255)
-        g = self.RANDOM(0, 255)
-        b = self.RANDOM(0, 255)
-        set_section_solid((r,g,b),length, int)
+        v = self.RANDOM(0, 0xFFFFFF)
+        self.set_section_solid((v>>16, (v>>8) & 0xFF, v & 0xFF), length, index)
         
     def get_pixel_color(self, i: int) -> (int, int, int):
         """
@@ -293,11 +504,7 @@ class WS2812:
         (int, int, int): (R,G,B) color representation
         
         """
-        color = self.AR[i]
-        r : int = ((color >> 8) & 0xFF)
-        g : int = ((color >> 16) & 0xFF)
-        b : int = (color & 0xFF)
-        return (r,g,b)
+        return (self.RED[i], self.GREEN[i], self.BLUE[i])
     
     def pixel_on(self, i: int) -> bool:
         """
@@ -323,7 +530,25 @@ class WS2812:
         float: A value between 0 and 1 representing the pixel's brightness
         
         """
-        return self.BRIGHTNESS[i]
+        return self.BRIGHTNESS[i] / 256
+    
+    def set_gamma(self, gamma: float):
+        """
+        Sets the gamma correction applied to pixel colors.
+        
+        Args:
+        gamma (float): The gamma exponent to apply, where 1 leaves colors unchanged (the default) and values around 2.2 give perceptually even dimming.
+        
+        Raises:
+        ValueError: If gamma isn't greater than 0.
+        
+        """
+        if gamma <= 0:
+            raise ValueError("gamma must be greater than 0")
+        table = self.GAMMA
+        for v in range(256):
+            table[v] = int(((v / 255) ** gamma) * 255 + 0.5)
+        self.DIRTY = True
     
     def change_number_generator(random_generator: Callable(int, int)):
         """